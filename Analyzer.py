@@ -1,15 +1,30 @@
 import chess.pgn
 import chess.engine
+import chess.polyglot
 import sys
 import tkinter as tk
 from PIL import Image, ImageTk
 import os
-import time
+import io
+import queue
+import re
+import threading
+import shelve
+from concurrent.futures import ThreadPoolExecutor
 
 # === CONFIGURATION ===
 STOCKFISH_PATH = "stockfish/stockfish-windows-x86-64-avx2.exe"
-ANALYSIS_TIME = 0.3
+ANALYSIS_NODES = 200_000  # easy positions finish early instead of burning a fixed time
+# Either one multi-threaded engine (ENGINE_WORKERS = 1) that reuses its hash
+# table across consecutive plies, or a pool of single-threaded engines
+ENGINE_WORKERS = os.cpu_count() or 1  # >1 runs that many single-threaded engines
+ENGINE_HASH_MB = 512  # large enough to keep TT entries between plies
+ENGINE_THREADS = max(1, (os.cpu_count() or 1) - 1)
+WORKER_HASH_MB = 128
+CACHE_PATH = "analysis_cache.db"
+BOOK_PATH = "book.bin"  # optional PolyGlot opening book
 DELAY_BETWEEN_MOVES = .5  # seconds
+LOG_FLUSH_PLIES = 10  # write the move log to stdout in batches of this many plies
 THRESHOLD_BLUNDER = 300
 THRESHOLD_MISTAKE = 100
 THRESHOLD_INACCURACY = 50
@@ -18,6 +33,16 @@ SQUARE_SIZE = 64
 BOARD_SIZE = SQUARE_SIZE * 8
 MESSAGE_HEIGHT = 38
 
+_WHITE = chess.WHITE
+_TAG_RE = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+_SAN_RE = re.compile(r"[NBRQK]?[a-h]?[1-8]?x?[a-h][1-8](?:=[NBRQ])?[+#]?|[O0]-[O0](?:-[O0])?[+#]?")
+_MOVE_NUMBER_RE = re.compile(r"\d+\.+")
+_RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+
+# Top-left canvas corner of each square, indexed by chess.SQUARES
+_SQ_XY = [(chess.square_file(s) * SQUARE_SIZE, (7 - chess.square_rank(s)) * SQUARE_SIZE)
+          for s in chess.SQUARES]
+
 # === GUI CLASS ===
 class ChessGUI:
     def __init__(self, root):
@@ -25,9 +50,28 @@ class ChessGUI:
         self.canvas = tk.Canvas(root, width=BOARD_SIZE, height=BOARD_SIZE + MESSAGE_HEIGHT)
         self.canvas.pack()
         self.square_colors = [(238, 238, 210), (118, 150, 86)]
+        self.square_hex = ["#%02x%02x%02x" % c for c in self.square_colors]
         self.piece_images = self.load_piece_images()
         self.message = ""
-        self.arrow = None
+
+        # Canvas items are created once and reconfigured on every redraw
+        self.square_ids = []
+        for x, y in _SQ_XY:
+            self.square_ids.append(self.canvas.create_rectangle(
+                x, y, x + SQUARE_SIZE, y + SQUARE_SIZE,
+                fill=self.square_hex[((x + y) // SQUARE_SIZE) & 1], outline=""))
+        self.piece_ids = [self.canvas.create_image(x, y, anchor='nw', image='')
+                          for x, y in _SQ_XY]
+        self._last_piece_map = {}
+
+        self.arrow = self.canvas.create_line(0, 0, 0, 0, fill="red", width=3,
+                                             arrow=tk.LAST, state='hidden')
+        self.message_box = self.canvas.create_rectangle(
+            0, BOARD_SIZE, BOARD_SIZE, BOARD_SIZE + MESSAGE_HEIGHT,
+            fill="white", outline="", state='hidden')
+        self.message_text = self.canvas.create_text(
+            BOARD_SIZE // 2, BOARD_SIZE + MESSAGE_HEIGHT // 2,
+            text="", font=("Arial", 16, "bold"), fill="red", state='hidden')
 
     def load_piece_images(self):
         images = {}
@@ -40,122 +84,383 @@ class ChessGUI:
         for symbol, file in piece_map.items():
             path = os.path.join(PIECE_FOLDER, file)
             if os.path.exists(path):
-                img = Image.open(path).resize((SQUARE_SIZE, SQUARE_SIZE))
+                # Convert once up front; bilinear is plenty at this size and
+                # much cheaper than the default bicubic on the JPG sources
+                img = Image.open(path).convert("RGBA").resize(
+                    (SQUARE_SIZE, SQUARE_SIZE), Image.Resampling.BILINEAR)
                 images[symbol] = ImageTk.PhotoImage(img)
         return images
 
     def draw_board(self, board, best_move=None):
-        self.canvas.delete("all")
-        # Draw squares
-        for row in range(8):
-            for col in range(8):
-                color = self.square_colors[(row + col) % 2]
-                x0 = col * SQUARE_SIZE
-                y0 = row * SQUARE_SIZE
-                x1 = x0 + SQUARE_SIZE
-                y1 = y0 + SQUARE_SIZE
-                self.canvas.create_rectangle(x0, y0, x1, y1, fill=self._rgb(color), outline="")
-
-        # Draw pieces
-        for square in chess.SQUARES:
-            piece = board.piece_at(square)
-            if piece:
-                symbol = piece.symbol()
-                img = self.piece_images.get(symbol)
-                if img:
-                    col = chess.square_file(square)
-                    row = 7 - chess.square_rank(square)
-                    x = col * SQUARE_SIZE
-                    y = row * SQUARE_SIZE
-                    self.canvas.create_image(x, y, anchor='nw', image=img)
-
-        # Draw best move arrow if provided
+        # Update only the squares that changed since the last frame; a move
+        # touches at most four
+        new = {sq: piece.symbol() for sq, piece in board.piece_map().items()}
+        old = self._last_piece_map
+        changed = (new.keys() ^ old.keys()) | {sq for sq in new if new[sq] != old.get(sq)}
+        for sq in changed:
+            self.canvas.itemconfigure(self.piece_ids[sq],
+                                      image=self.piece_images.get(new.get(sq), ''))
+        self._last_piece_map = new
+
+        # Move best move arrow if provided
         if best_move:
-            from_sq = best_move.from_square
-            to_sq = best_move.to_square
-            fx, fy = chess.square_file(from_sq), 7 - chess.square_rank(from_sq)
-            tx, ty = chess.square_file(to_sq), 7 - chess.square_rank(to_sq)
-            self.canvas.create_line(
-                fx * SQUARE_SIZE + SQUARE_SIZE // 2, fy * SQUARE_SIZE + SQUARE_SIZE // 2,
-                tx * SQUARE_SIZE + SQUARE_SIZE // 2, ty * SQUARE_SIZE + SQUARE_SIZE // 2,
-                fill="red", width=3, arrow=tk.LAST
-            )
-
-        # Draw message
-        if self.message:
-            self.canvas.create_rectangle(0, BOARD_SIZE, BOARD_SIZE, BOARD_SIZE + MESSAGE_HEIGHT, fill="white", outline="")
-            self.canvas.create_text(BOARD_SIZE // 2, BOARD_SIZE + MESSAGE_HEIGHT // 2,
-                                    text=self.message, font=("Arial", 16, "bold"), fill="red")
-
-        self.root.update()
-
-    def _rgb(self, rgb_tuple):
-        return "#%02x%02x%02x" % rgb_tuple
+            fx, fy = _SQ_XY[best_move.from_square]
+            tx, ty = _SQ_XY[best_move.to_square]
+            half = SQUARE_SIZE // 2
+            self.canvas.coords(self.arrow, fx + half, fy + half, tx + half, ty + half)
+            self.canvas.itemconfigure(self.arrow, state='normal')
+        else:
+            self.canvas.itemconfigure(self.arrow, state='hidden')
+
+        self.show_message()
+
+    def show_message(self):
+        state = 'normal' if self.message else 'hidden'
+        self.canvas.itemconfigure(self.message_box, state=state)
+        self.canvas.itemconfigure(self.message_text, text=self.message, state=state)
+
+    def play(self, frames):
+        """Replay (fen, best_move, message) frames from a queue at a steady
+        cadence. The last frame is None when the game was analysed in full,
+        or an error message when analysis failed."""
+        self.frames = frames
+        self.root.after(int(DELAY_BETWEEN_MOVES * 1000), self._tick)
+
+    def _tick(self):
+        try:
+            frame = self.frames.get_nowait()
+        except queue.Empty:
+            # Analysis hasn't caught up with playback yet
+            self.root.after(int(DELAY_BETWEEN_MOVES * 1000), self._tick)
+            return
+        if frame is None:
+            print("\n✅ Real-time analysis complete.")
+            return
+        if isinstance(frame, str):
+            self.message = frame
+            self.show_message()
+            return
+
+        fen, best_move, self.message = frame
+        self.draw_board(chess.Board(fen), best_move)
+        self.root.after(int(DELAY_BETWEEN_MOVES * 1000), self._tick)
 
 # === ANALYSIS LOGIC ===
-def analyze_game(pgn_path):
+def open_engine(threads, hash_mb):
+    engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH)
+    # python-chess only sends ucinewgame when the game changes, so the hash
+    # table carries over between plies analysed by the same engine
+    engine.configure({"Hash": hash_mb, "Threads": threads})
+    return engine
+
+def white_score(info):
+    return info["score"].pov(_WHITE).score(mate_score=10000)
+
+def analyse_ply(engine, start_fen, moves, index):
+    # Replay the game up to this ply so the engine sees the move history
+    # (and with it repetitions), not just the bare position
+    board = chess.Board(start_fen)
+    for move in moves[:index]:
+        board.push(move)
+    move = moves[index]
+    # Analyse the top two lines before the move; the played move is
+    # usually one of them, so its score comes for free
+    infos = engine.analyse(board, chess.engine.Limit(nodes=ANALYSIS_NODES), multipv=2)
+    best_move = infos[0].get("pv", [None])[0]
+    for info in infos:
+        if info.get("pv", [None])[0] == move:
+            return white_score(info), best_move
+
+    board.push(move)
+    played_info = engine.analyse(board, chess.engine.Limit(nodes=ANALYSIS_NODES // 4))
+    return white_score(played_info), best_move
+
+def cache_key(fen, move):
+    # The position fields of the FEN ignore move counters, so transposed and
+    # repeated positions share an entry; the limit is part of the key since
+    # it changes the result
+    position = " ".join(fen.split()[:4])
+    return f"{position}:{move.uci()}:{ANALYSIS_NODES}"
+
+def search_plies(plies, stop):
+    """Analyse (start_fen, moves, index) plies across a pool of engines,
+    returning (score, best_move) for each ply in order until stop is set."""
+    if not plies:
+        return
+    workers = max(1, min(ENGINE_WORKERS, len(plies)))
+    engines = []
+    idle = queue.Queue()
+
+    def run(ply):
+        engine = idle.get()
+        try:
+            return analyse_ply(engine, *ply)
+        finally:
+            idle.put(engine)
+
+    pool = ThreadPoolExecutor(workers)
     try:
-        with open(pgn_path) as pgn:
-            game = chess.pgn.read_game(pgn)
+        # Engines are registered as they start, so a failure part way
+        # through still quits the ones already running
+        for _ in range(workers):
+            if workers == 1:
+                engine = open_engine(ENGINE_THREADS, ENGINE_HASH_MB)
+            else:
+                # Several single-threaded engines beat one multi-threaded
+                # engine when there are many independent positions to search
+                engine = open_engine(1, WORKER_HASH_MB)
+            engines.append(engine)
+            idle.put(engine)
 
-        if not game:
-            print("No game found in the PGN file.")
-            return
+        for result in pool.map(run, plies):
+            if stop.is_set():
+                return
+            yield result
+    finally:
+        # Drop queued searches, otherwise interpreter exit waits for the
+        # whole game; only the searches already running are finished
+        pool.shutdown(cancel_futures=True)
+        for engine in engines:
+            engine.quit()
 
-        board = game.board()
-        engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH)
+def book_moves(plies):
+    """Return the book's preferred move for each leading ply whose played
+    move is still in the opening book."""
+    if not os.path.exists(BOOK_PATH):
+        return []
+    best_moves = []
+    with chess.polyglot.open_reader(BOOK_PATH) as reader:
+        for fen, move in plies:
+            entries = list(reader.find_all(chess.Board(fen)))
+            if move not in [entry.move for entry in entries]:
+                break
+            best_moves.append(max(entries, key=lambda entry: entry.weight).move)
+    return best_moves
 
-        print("\n🔍 Starting real-time analysis...\n")
+def analyse_plies(fens, moves, stop):
+    """Like search_plies, but scores book moves as level without touching
+    the engine, serves plies seen in earlier runs from the on-disk cache
+    and only searches the rest."""
+    # The first move out of book is still searched, so a bad deviation
+    # shows up as a drop from the level book score
+    plies = list(zip(fens, moves))
+    book = book_moves(plies)
+    for best_move in book:
+        yield 0, best_move
+    plies = plies[len(book):]
 
-        root = tk.Tk()
-        root.title("Chess Analyzer")
-        gui = ChessGUI(root)
-        gui.draw_board(board)
+    with shelve.open(CACHE_PATH) as cache:
+        keys = [cache_key(fen, move) for fen, move in plies]
+        misses = {i for i, key in enumerate(keys) if key not in cache}
+        searched = search_plies([(fens[0], moves, len(book) + i) for i in sorted(misses)], stop)
+
+        try:
+            for i, key in enumerate(keys):
+                if i in misses:
+                    score, best_move = next(searched, (None, None))
+                    if stop.is_set():
+                        return
+                    cache[key] = (score, best_move.uci() if best_move else None)
+                else:
+                    score, best_uci = cache[key]
+                    best_move = chess.Move.from_uci(best_uci) if best_uci else None
+                yield score, best_move
+        finally:
+            searched.close()
 
+def flush_log(out):
+    if out:
+        sys.stdout.write("\n".join(out) + "\n")
+        sys.stdout.flush()
+        out.clear()
+
+def produce_frames(fens, moves, frames, stop):
+    """Analyse the game and queue one (fen, best_move, message) frame per
+    ply for the GUI, followed by None. fens holds the position before
+    each move plus the final position. Setting stop abandons the rest of
+    the game."""
+    out = []
+    error = None
+    plies = list(zip(fens, moves))
+    results = analyse_plies(fens, moves, stop)
+    try:
         prev_score = None
         move_number = 1
 
-        for move in game.mainline_moves():
-            player = "White" if board.turn else "Black"
-            # Get best move before making the actual move
-            best_info = engine.analyse(board, chess.engine.Limit(time=ANALYSIS_TIME))
-            best_move = best_info.get("pv", [None])[0]
-
-            board.push(move)
-            played_info = engine.analyse(board, chess.engine.Limit(time=ANALYSIS_TIME))
-            score = played_info["score"].white().score(mate_score=10000)
+        for i, ((score, best_move), (fen, move)) in enumerate(zip(results, plies)):
+            if stop.is_set():
+                break
+            player = "White" if fen.split()[1] == "w" else "Black"
 
             prefix = f"{move_number}. " if player == "White" else f"{move_number}... "
-            print(f"{prefix}{move} — {player} to move — Score: {score / 100.0:.2f} cp")
+            out.append(f"{prefix}{move} — {player} to move — Score: {score / 100.0:.2f} cp")
 
-            gui.message = ""
-            arrow = None
+            message = ""
 
             if prev_score is not None and score is not None:
                 drop = prev_score - score
                 if drop >= THRESHOLD_BLUNDER:
-                    gui.message = f"⛔ {player} blundered!"
-                    arrow = best_move
-                    print(f"  {gui.message} (Drop: {drop} cp)")
+                    message = f"⛔ {player} blundered!"
+                    out.append(f"  {message} (Drop: {drop} cp)")
                 elif drop >= THRESHOLD_MISTAKE:
-                    gui.message = f"⚠️ {player} made a mistake!"
-                    arrow = best_move
-                    print(f"  {gui.message} (Drop: {drop} cp)")
+                    message = f"⚠️ {player} made a mistake!"
+                    out.append(f"  {message} (Drop: {drop} cp)")
                 elif drop >= THRESHOLD_INACCURACY:
-                    gui.message = f"❗ {player} was inaccurate!"
-                    arrow = best_move
-                    print(f"  {gui.message} (Drop: {drop} cp)")
+                    message = f"❗ {player} was inaccurate!"
+                    out.append(f"  {message} (Drop: {drop} cp)")
 
             prev_score = score
-            gui.draw_board(board, best_move if gui.message else None)
-            time.sleep(DELAY_BETWEEN_MOVES)
+            frames.put((fens[i + 1], best_move if message else None, message))
 
             if player == "Black":
                 move_number += 1
+            if (i + 1) % LOG_FLUSH_PLIES == 0:
+                flush_log(out)
+    except Exception as e:
+        error = "❌ Error during analysis, see console"
+        out.append(f"❌ Error during analysis: {e}")
+    finally:
+        # End marker first, so the GUI never waits on a thread that failed
+        # while shutting down
+        frames.put(error)
+        try:
+            # Closes the cache and shuts down the engines even when stopped early
+            results.close()
+        except Exception as e:
+            out.append(f"❌ Error shutting down engines: {e}")
+        flush_log(out)
+
+def open_pgn(pgn_path):
+    """Open a PGN file as a text stream. It is read lazily, so only the
+    first game is pulled in even from a large archive. A UTF-8 BOM is
+    skipped; bytes that aren't UTF-8 (e.g. Latin-1 names in the tags)
+    become U+FFFD rather than failing, which leaves the moves intact."""
+    return open(pgn_path, encoding="utf-8-sig", errors="replace")
+
+def strip_comments(line, in_comment):
+    """Return the part of a movetext line outside {...} and ; comments, and
+    whether a {...} comment is still open at the end of the line."""
+    text = []
+    i = 0
+    while i < len(line):
+        if in_comment:
+            end = line.find("}", i)
+            if end < 0:
+                break
+            in_comment = False
+            i = end + 1
+        elif line[i] == "{":
+            in_comment = True
+            i += 1
+        elif line[i] == ";":
+            break  # rest-of-line comment
+        else:
+            text.append(line[i])
+            i += 1
+    return "".join(text), in_comment
+
+def read_mainline(pgn):
+    """Return (start_fen, moves) for the first game in a PGN stream, or None
+    if there is no game. Plain movetext is tokenised directly; anything the
+    fast path can't handle goes through the full chess.pgn parser."""
+    lines = []
+    headers = {}
+    tokens = []
+    started = False
+    in_comment = False
+    for line in pgn:
+        # Tag pairs, escapes and blank lines only count outside comments,
+        # which may be wrapped onto lines starting with "[%clk"
+        if not in_comment:
+            if line.startswith("["):
+                if started:
+                    break  # start of the next game
+                tag = _TAG_RE.match(line)
+                if tag:
+                    headers[tag.group(1)] = tag.group(2)
+                lines.append(line)
+                continue
+            if line.startswith("%"):
+                lines.append(line)
+                continue
+            if not line.strip():
+                if started:
+                    break  # end of the movetext
+                lines.append(line)
+                continue
+
+        started = True
+        lines.append(line)
+        text, in_comment = strip_comments(line, in_comment)
+        ended = False
+        for tok in _MOVE_NUMBER_RE.sub(" ", text).split():
+            if tok in _RESULTS:
+                ended = True
+                break
+            tokens.append(tok)
+        if ended:
+            break
+
+    # Variations, NAGs, variants and anything else that isn't a bare SAN
+    # move need the real parser
+    if "Variant" not in headers and all(_SAN_RE.fullmatch(tok) for tok in tokens):
+        try:
+            board = chess.Board(headers["FEN"]) if "FEN" in headers else chess.Board()
+            start_fen = board.fen()
+            moves = [board.push_san(tok) for tok in tokens]
+            if moves:
+                return start_fen, moves
+        except ValueError:
+            pass
+
+    game = chess.pgn.read_game(io.StringIO("".join(lines)))
+    if not game:
+        return None
+    return game.board().fen(), list(game.mainline_moves())
+
+def analyze_game(pgn_path):
+    try:
+        with open_pgn(pgn_path) as pgn:
+            mainline = read_mainline(pgn)
+
+        if not mainline:
+            print("No game found in the PGN file.")
+            return
+
+        start_fen, moves = mainline
+
+        # Every position up front, so the engines can work through them
+        # independently of playback; FENs are far smaller than boards
+        board = chess.Board(start_fen)
+        fens = [start_fen]
+        for move in moves:
+            board.push(move)
+            fens.append(board.fen())
+
+        print("\n🔍 Starting real-time analysis...\n")
+
+        root = tk.Tk()
+        root.title("Chess Analyzer")
+        gui = ChessGUI(root)
+        gui.draw_board(chess.Board(start_fen))
+
+        # Analysis runs ahead in the background while the GUI replays
+        # finished plies from the queue
+        frames = queue.Queue()
+        stop = threading.Event()
+
+        def close():
+            stop.set()
+            root.destroy()
 
-        engine.quit()
-        print("\n✅ Real-time analysis complete.")
+        root.protocol("WM_DELETE_WINDOW", close)
+        producer = threading.Thread(target=produce_frames, args=(fens, moves, frames, stop),
+                                    daemon=True)
+        producer.start()
+        gui.play(frames)
         root.mainloop()
+        # Let the producer cancel outstanding searches and quit the engines
+        producer.join()
 
     except FileNotFoundError:
         print(f"❌ PGN file not found: {pgn_path}")
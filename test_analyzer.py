@@ -0,0 +1,61 @@
+import io
+
+import pytest
+
+chess = pytest.importorskip("chess")
+pytest.importorskip("PIL")
+pytest.importorskip("tkinter")
+
+import Analyzer
+
+
+def mainline_ucis(text):
+    start_fen, moves = Analyzer.read_mainline(io.StringIO(text))
+    return start_fen, [move.uci() for move in moves]
+
+
+def test_plain_movetext():
+    _, moves = mainline_ucis('[Event "a"]\n\n1. e4 e5 2. Nf3 Nc6 *\n')
+    assert moves == ["e2e4", "e7e5", "g1f3", "b8c6"]
+
+
+def test_castling_with_zeros():
+    _, moves = mainline_ucis("1. e4 e5 2. Nf3 Nf6 3. Bc4 Bc5 4. 0-0 0-0 5. d3 d6 *")
+    assert moves == ["e2e4", "e7e5", "g1f3", "g8f6", "f1c4", "f8c5",
+                     "e1g1", "e8g8", "d2d3", "d7d6"]
+
+
+def test_unknown_token_falls_back_to_parser():
+    _, moves = mainline_ucis("1. e4 e5 2. -- Nf6 *")
+    assert moves == ["e2e4", "e7e5", "0000", "g8f6"]
+
+
+def test_wrapped_comments_are_not_tag_lines():
+    text = (
+        '[Event "a"]\n'
+        '\n'
+        '1. e4 { [%clk 0:03:00] } 1... e5 { [%clk 0:03:00] } 2. Nf3 {\n'
+        '[%clk 0:02:58] } 2... Nc6 { [%clk 0:02:57] [%eval 0.31] } 3. Bb5 {\n'
+        '[%clk 0:02:55] } 3... a6 { [%clk 0:02:50] } 1-0\n'
+    )
+    _, moves = mainline_ucis(text)
+    assert moves == ["e2e4", "e7e5", "g1f3", "b8c6", "f1b5", "a7a6"]
+
+
+def test_stops_at_result_and_blank_line():
+    _, moves = mainline_ucis('[Event "a"]\n\n1. e4 e5 1-0\n\n1. Nf3 *\n')
+    assert moves == ["e2e4", "e7e5"]
+
+    text = '[Event "a"]\n\n1. d4 d5\n\n[Event "b"]\n\n1. e4 e5 *\n'
+    _, moves = mainline_ucis(text)
+    assert moves == ["d2d4", "d7d5"]
+
+
+def test_header_only_game():
+    start_fen, moves = mainline_ucis('[Event "a"]\n[Result "*"]\n\n*\n')
+    assert start_fen == chess.STARTING_FEN
+    assert moves == []
+
+
+def test_no_game():
+    assert Analyzer.read_mainline(io.StringIO("")) is None